@@ -5,7 +5,14 @@ from pydantic import BaseModel, Field
 
 from . import model
 from .auth import UserToken
-from .model import LiveDifficulty
+from .model import (
+    JoinRoomResult,
+    LiveDifficulty,
+    ResultUser,
+    RoomInfo,
+    RoomUser,
+    WaitRoomStatus,
+)
 
 app = FastAPI()
 
@@ -88,6 +95,88 @@ class CreateRoomRequest(BaseModel):
 @app.post("/room/create")
 def create(token: UserToken, req: CreateRoomRequest) -> RoomID:
     """ルーム作成リクエスト"""
-    print("/room/create", req)
     room_id = model.create_room(token, req.live_id, req.select_difficulty)
     return RoomID(room_id=room_id)
+
+
+class RoomListRequest(BaseModel):
+    live_id: int
+    # 前回の一覧の最後の room_id を指定すると続きを取得できる
+    after_room_id: int = Field(default=0, title="このIDより後のルームを返す")
+
+
+class RoomListResponse(BaseModel, strict=True):
+    room_info_list: list[RoomInfo]
+
+
+@app.post("/room/list")
+def fetch_list(req: RoomListRequest) -> RoomListResponse:
+    """現在入場可能なルーム取得リクエスト"""
+    room_info_list = model.list_room(req.live_id, req.after_room_id)
+    return RoomListResponse(room_info_list=room_info_list)
+
+
+class RoomJoinRequest(BaseModel):
+    room_id: int
+    select_difficulty: LiveDifficulty
+
+
+class RoomJoinResponse(BaseModel, strict=True):
+    join_room_result: JoinRoomResult
+
+
+@app.post("/room/join")
+def join(token: UserToken, req: RoomJoinRequest) -> RoomJoinResponse:
+    """ルーム入場リクエスト"""
+    result = model.join_room(token, req.room_id, req.select_difficulty)
+    return RoomJoinResponse(join_room_result=result)
+
+
+class RoomWaitResponse(BaseModel, strict=True):
+    status: WaitRoomStatus
+    room_user_list: list[RoomUser]
+
+
+@app.post("/room/wait")
+def wait(token: UserToken, req: RoomID) -> RoomWaitResponse:
+    """ルーム待機中（ポーリング）。APIの結果でゲーム開始がわかる"""
+    status, room_user_list = model.wait_room(token, req.room_id)
+    return RoomWaitResponse(status=status, room_user_list=room_user_list)
+
+
+@app.post("/room/start")
+def start(token: UserToken, req: RoomID) -> Empty:
+    """ルームのライブ開始リクエスト。部屋のオーナーが叩く"""
+    model.start_room(token, req.room_id)
+    return Empty()
+
+
+class RoomEndRequest(BaseModel):
+    room_id: int
+    judge_count_list: list[int]
+    score: int
+
+
+@app.post("/room/end")
+def end(token: UserToken, req: RoomEndRequest) -> Empty:
+    """ルームのライブ終了時リクエスト。ゲーム終わったら各人が叩く"""
+    model.end_room(token, req.room_id, req.judge_count_list, req.score)
+    return Empty()
+
+
+class RoomResultResponse(BaseModel, strict=True):
+    result_user_list: list[ResultUser]
+
+
+@app.post("/room/result")
+def result(req: RoomID) -> RoomResultResponse:
+    """ルームのライブ終了後、リザルト遷移チェックのリクエスト。end 叩いたあとにこれをポーリングする"""
+    result_user_list = model.result_room(req.room_id)
+    return RoomResultResponse(result_user_list=result_user_list)
+
+
+@app.post("/room/leave")
+def leave(token: UserToken, req: RoomID) -> Empty:
+    """ルーム退出リクエスト。オーナーも参加者も実行できる"""
+    model.leave_room(token, req.room_id)
+    return Empty()
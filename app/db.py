@@ -2,4 +2,41 @@ from sqlalchemy import create_engine
 
 from . import config
 
-engine = create_engine(config.DATABASE_URI, future=True, echo=True, pool_recycle=300)
+# コネクションプールの大きさは同時に処理するリクエスト数に合わせる。
+# FastAPI は def のAPIをスレッドプール (デフォルト40スレッド) で実行するので、
+# engine と autocommit_engine の pool_size + max_overflow の合計をそれ以上にしても使われない。
+# そこで2つのエンジンで半分ずつ (それぞれ最大20) にする。
+# 逆に小さすぎると、DBが空いていてもコネクションの取得待ちになる。
+# MySQL 側の max_connections は プロセス数 * 40 以上にする。
+# pool_pre_ping は取り出すたびに1往復 (SELECT 1 相当) 増えるので使わない。
+# 代わりに pool_recycle を MySQL の wait_timeout (デフォルト8時間) より十分短くして、
+# サーバーに切断された古いコネクションを使わないようにする。
+# pool_use_lifo=True で直前に使ったコネクションから再利用し、
+# 負荷が下がったときに余ったコネクションがアイドルのまま閉じられるようにする。
+# pool_timeout はコネクションの取得待ちの上限。デフォルトの30秒だと、
+# 負荷が集中したときにリクエストが長時間滞留するので早めにエラーにする。
+_POOL_OPTIONS = {
+    "pool_size": 10,
+    "max_overflow": 10,
+    "pool_pre_ping": False,
+    "pool_use_lifo": True,
+    "pool_recycle": 1800,
+    "pool_timeout": 10,
+}
+
+engine = create_engine(config.DATABASE_URI, future=True, echo=True, **_POOL_OPTIONS)
+
+# 読み込みだけの処理で使う。
+# engine.execution_options(isolation_level=...) で engine のプールを共有すると、
+# コネクションを取り出すたびに SET AUTOCOMMIT=1 、返すたびに元の分離レベルへ戻す
+# SET と COMMIT が発行されて往復が増える。別のエンジン (別のプール) にして、
+# AUTOCOMMIT の設定は物理コネクションを作ったときの1回だけにする。
+# skip_autocommit_rollback=True で、プールに返すときの ROLLBACK も省く。
+autocommit_engine = create_engine(
+    config.DATABASE_URI,
+    future=True,
+    echo=True,
+    isolation_level="AUTOCOMMIT",
+    skip_autocommit_rollback=True,
+    **_POOL_OPTIONS,
+)
@@ -1,11 +1,16 @@
+import logging
 import uuid
 from enum import IntEnum
+from threading import Lock
 
+from cachetools import TTLCache
 from pydantic import BaseModel
-from sqlalchemy import text
-from sqlalchemy.exc import NoResultFound
+from sqlalchemy import JSON, bindparam, text
+from sqlalchemy.exc import IntegrityError
 
-from .db import engine
+from .db import autocommit_engine, engine
+
+logger = logging.getLogger(__name__)
 
 
 class InvalidToken(Exception):
@@ -13,7 +18,8 @@ class InvalidToken(Exception):
 
 
 # サーバーで生成するオブジェクトは strict を使う
-class SafeUser(BaseModel, strict=True):
+# SafeUser はキャッシュしてスレッド間で共有するので frozen にする
+class SafeUser(BaseModel, strict=True, frozen=True):
     """token を含まないUser"""
 
     id: int
@@ -21,38 +27,108 @@ class SafeUser(BaseModel, strict=True):
     leader_card_id: int
 
 
+# SQL は呼び出しのたびに text() を作らず、モジュールレベルで一度だけ作って使い回す。
+# 同じ TextClause を使うことで SQLAlchemy のコンパイル済みキャッシュが効く。
+# 定数のパラメータは bindparams() で文に持たせ、呼び出し側では渡さない。
+_SQL_INSERT_USER = text(
+    "INSERT INTO `user` (name, token, leader_card_id)"
+    " VALUES (:name, UNHEX(:token), :leader_card_id)"
+)
+
+
 def create_user(name: str, leader_card_id: int) -> str:
     """Create new user and returns their token"""
-    # UUID4は天文学的な確率だけど衝突する確率があるので、気にするならリトライする必要がある。
-    # サーバーでリトライしない場合は、クライアントかユーザー（手動）にリトライさせることになる。
-    # ユーザーによるリトライは一般的には良くないけれども、確率が非常に低ければ許容できる場合もある。
-    token = str(uuid.uuid4())
+    # UUID4 (122bit) が50%の確率で衝突するのは約 2.7×10^18 個生成したときなのでリトライしない。
+    # 万一衝突したときは token の UNIQUE 制約で IntegrityError になり、500 エラーを返す。
+    # token は32桁の16進数文字列で返し、DBには BINARY(16) で保存する。
+    # 16進数でない token は UNHEX() が NULL になり、どのユーザーにも一致しない。
+    token = uuid.uuid4().hex
     with engine.begin() as conn:
         result = conn.execute(
-            text(
-                "INSERT INTO `user` (name, token, leader_card_id)"
-                " VALUES (:name, :token, :leader_card_id)"
-            ),
+            _SQL_INSERT_USER,
             {"name": name, "token": token, "leader_card_id": leader_card_id},
         )
-        print(f"create_user(): {result.lastrowid=}")  # DB側で生成されたPRIMARY KEYを参照できる
+        # DB側で生成されたPRIMARY KEYを参照できる
+        logger.debug("create_user(): lastrowid=%s", result.lastrowid)
     return token
 
 
+_SQL_GET_USER_BY_TOKEN = text(
+    "SELECT `id`, `name`, `leader_card_id` FROM `user` WHERE `token`=UNHEX(:token)"
+)
+
+
 def _get_user_by_token(conn, token: str) -> SafeUser | None:
-    # TODO: 実装(わからなかったら資料を見ながら)
-    ...
+    row = conn.execute(_SQL_GET_USER_BY_TOKEN, {"token": token}).first()
+    if row is None:
+        return None
+    # DB から取得した値は型が保証されているので validation を省略する
+    return SafeUser.model_construct(
+        id=row.id, name=row.name, leader_card_id=row.leader_card_id
+    )
+
 
+# token から SafeUser へのキャッシュ。ほぼ全ての API の最初に行う
+# ユーザー検索の SELECT を省く。 update_user() で無効化する。
+# UNHEX() は大文字小文字を区別しないので、キーには小文字にした token を使う。
+_user_cache = TTLCache(maxsize=10_000, ttl=30)
+_user_cache_lock = Lock()
+# update_user() のたびに増やす。 SELECT している間に更新されたときは、
+# 読んだ古い値をキャッシュに書き戻さない。
+_user_cache_generation = 0
 
+
+def _get_cached_user(token: str) -> tuple[SafeUser | None, int]:
+    """キャッシュにある SafeUser と、そのときの世代を返します"""
+    with _user_cache_lock:
+        return _user_cache.get(token.lower()), _user_cache_generation
+
+
+def _cache_user(token: str, user: SafeUser, generation: int) -> None:
+    with _user_cache_lock:
+        if generation == _user_cache_generation:
+            _user_cache[token.lower()] = user
+
+
+def _get_user_by_token_cached(conn, token: str) -> SafeUser | None:
+    user, generation = _get_cached_user(token)
+    if user is None:
+        user = _get_user_by_token(conn, token)
+        if user is not None:
+            _cache_user(token, user, generation)
+    return user
+
+
+# 読み込みだけの処理は engine.begin() ではなく autocommit_engine.connect() を使い、
+# BEGIN/COMMIT やプールに返すときの ROLLBACK の往復を省く。
+# キャッシュにあるときはコネクションを取り出さない。
 def get_user_by_token(token: str) -> SafeUser | None:
-    with engine.begin() as conn:
-        return _get_user_by_token(conn, token)
+    user, generation = _get_cached_user(token)
+    if user is not None:
+        return user
+    with autocommit_engine.connect() as conn:
+        user = _get_user_by_token(conn, token)
+    if user is not None:
+        _cache_user(token, user, generation)
+    return user
+
+
+_SQL_UPDATE_USER = text(
+    "UPDATE `user` SET `name`=:name, `leader_card_id`=:leader_card_id"
+    " WHERE `token`=UNHEX(:token)"
+)
 
 
 def update_user(token: str, name: str, leader_card_id: int) -> None:
+    global _user_cache_generation
     with engine.begin() as conn:
-        # TODO: 実装
-        ...
+        conn.execute(
+            _SQL_UPDATE_USER,
+            {"name": name, "leader_card_id": leader_card_id, "token": token},
+        )
+    with _user_cache_lock:
+        _user_cache_generation += 1
+        _user_cache.pop(token.lower(), None)
 
 
 # IntEnum の使い方の例
@@ -63,10 +139,333 @@ class LiveDifficulty(IntEnum):
     hard = 2
 
 
-def create_room(token: str, live_id: int, difficulty: LiveDifficulty):
+class JoinRoomResult(IntEnum):
+    """ルーム入場の返却結果"""
+
+    Ok = 1
+    RoomFull = 2
+    Disbanded = 3
+    OtherError = 4
+
+
+class WaitRoomStatus(IntEnum):
+    """ルームの状態"""
+
+    Waiting = 1
+    LiveStart = 2
+    Dissolution = 3
+
+
+# 部屋の最大人数
+MAX_USER_COUNT = 4
+
+
+class RoomInfo(BaseModel, strict=True):
+    """入場可能なルームの情報"""
+
+    room_id: int
+    live_id: int
+    joined_user_count: int
+    max_user_count: int
+
+
+class RoomUser(BaseModel, strict=True):
+    """ルームにいるプレイヤーの情報"""
+
+    user_id: int
+    name: str
+    leader_card_id: int
+    select_difficulty: LiveDifficulty
+    is_me: bool
+    is_host: bool
+
+
+class ResultUser(BaseModel, strict=True):
+    """ライブ結果"""
+
+    user_id: int
+    judge_count_list: list[int]
+    score: int
+
+
+# token からのユーザー検索を INSERT ... SELECT にまとめて往復を減らす。
+# token が不正なときは1行も挿入されないので、 rowcount で判定する。
+_SQL_INSERT_ROOM = text(
+    "INSERT INTO `room` (`live_id`, `status`, `joined_user_count`, `max_user_count`)"
+    " SELECT :live_id, :status, 1, :max_user_count"
+    " FROM `user` WHERE `token`=UNHEX(:token)"
+).bindparams(status=WaitRoomStatus.Waiting.value, max_user_count=MAX_USER_COUNT)
+_SQL_INSERT_HOST_MEMBER = text(
+    "INSERT INTO `room_member` (`room_id`, `user_id`, `select_difficulty`, `is_host`)"
+    " SELECT :room_id, `id`, :select_difficulty, 1"
+    " FROM `user` WHERE `token`=UNHEX(:token)"
+)
+
+
+def create_room(token: str, live_id: int, difficulty: LiveDifficulty) -> int:
     """部屋を作ってroom_idを返します"""
     with engine.begin() as conn:
-        user = _get_user_by_token(conn, token)
+        result = conn.execute(
+            _SQL_INSERT_ROOM,
+            {"live_id": live_id, "token": token},
+        )
+        if result.rowcount == 0:
+            raise InvalidToken
+        room_id = result.lastrowid
+        conn.execute(
+            _SQL_INSERT_HOST_MEMBER,
+            {
+                "room_id": room_id,
+                "select_difficulty": int(difficulty),
+                "token": token,
+            },
+        )
+    _clear_room_list_cache()
+    return room_id
+
+
+# 一覧で一度に返すルームの最大数
+ROOM_LIST_LIMIT = 200
+
+# live_id が 0 のときも同じ文を使う。 PyMySQL はパラメータをクライアント側で
+# 埋め込むので、 MySQL のオプティマイザは `0 = 0` などを定数として畳み込める。
+# 続きは room_id をキーにしたページングで取得する (OFFSET は使わない)。
+_SQL_LIST_ROOM = text(
+    "SELECT `room_id`, `live_id`, `joined_user_count`, `max_user_count`"
+    " FROM `room`"
+    " WHERE (:live_id = 0 OR `live_id`=:live_id) AND `status`=:status"
+    " AND `joined_user_count` < `max_user_count` AND `room_id` > :after_room_id"
+    " ORDER BY `room_id` LIMIT :limit"
+).bindparams(status=WaitRoomStatus.Waiting.value, limit=ROOM_LIST_LIMIT)
+
+
+# ロビーで全クライアントがポーリングする list_room の最初のページを live_id ごとに
+# 短時間キャッシュする。ルームの作成・入場・退出・開始で消す。
+# 続きのページはクライアントが任意の after_room_id を指定できるので、
+# キャッシュすると最初のページのエントリが追い出されてしまう。キャッシュしない。
+_room_list_cache = TTLCache(maxsize=64, ttl=2)
+_room_list_cache_lock = Lock()
+
+
+def _clear_room_list_cache() -> None:
+    with _room_list_cache_lock:
+        _room_list_cache.clear()
+
+
+def list_room(live_id: int, after_room_id: int = 0) -> list[RoomInfo]:
+    """入場可能なルーム一覧を返します。live_id が 0 のときは全てのルームが対象
+
+    room_id が after_room_id より大きいルームを、 room_id 順に最大 ROOM_LIST_LIMIT 件返します。
+    """
+    use_cache = after_room_id == 0
+    if use_cache:
+        with _room_list_cache_lock:
+            room_infos = _room_list_cache.get(live_id)
+        if room_infos is not None:
+            return room_infos
+    with autocommit_engine.connect() as conn:
+        result = conn.execute(
+            _SQL_LIST_ROOM, {"live_id": live_id, "after_room_id": after_room_id}
+        )
+        # DB から取得した値なので validation を省略する
+        room_infos = [
+            RoomInfo.model_construct(
+                room_id=row["room_id"],
+                live_id=row["live_id"],
+                joined_user_count=row["joined_user_count"],
+                max_user_count=row["max_user_count"],
+            )
+            for row in result.mappings()
+        ]
+    if use_cache:
+        with _room_list_cache_lock:
+            _room_list_cache[live_id] = room_infos
+    return room_infos
+
+
+_SQL_INCREMENT_JOINED_USER_COUNT = text(
+    "UPDATE `room` SET `joined_user_count`=`joined_user_count` + 1"
+    " WHERE `room_id`=:room_id AND `status`=:waiting"
+    " AND `joined_user_count` < `max_user_count`"
+).bindparams(waiting=WaitRoomStatus.Waiting.value)
+_SQL_GET_ROOM_STATUS = text("SELECT `status` FROM `room` WHERE `room_id`=:room_id")
+_SQL_INSERT_GUEST_MEMBER = text(
+    "INSERT INTO `room_member` (`room_id`, `user_id`, `select_difficulty`, `is_host`)"
+    " SELECT :room_id, `id`, :select_difficulty, 0"
+    " FROM `user` WHERE `token`=UNHEX(:token)"
+)
+
+
+def join_room(token: str, room_id: int, difficulty: LiveDifficulty) -> JoinRoomResult:
+    """部屋に入場します"""
+    try:
+        with engine.begin() as conn:
+            # 空きがあるときだけ人数を増やす。SELECT ... FOR UPDATE で読んでから
+            # 書き戻す必要がなく、同時に入場しても定員を超えない。
+            result = conn.execute(
+                _SQL_INCREMENT_JOINED_USER_COUNT, {"room_id": room_id}
+            )
+            if result.rowcount == 0:
+                # 入場できなかった理由を調べる
+                status = conn.scalar(_SQL_GET_ROOM_STATUS, {"room_id": room_id})
+                if status is None:
+                    return JoinRoomResult.OtherError
+                if status != WaitRoomStatus.Waiting:
+                    return JoinRoomResult.Disbanded
+                return JoinRoomResult.RoomFull
+            result = conn.execute(
+                _SQL_INSERT_GUEST_MEMBER,
+                {
+                    "room_id": room_id,
+                    "select_difficulty": int(difficulty),
+                    "token": token,
+                },
+            )
+            if result.rowcount == 0:
+                # 例外でロールバックされ、増やした人数も元に戻る
+                raise InvalidToken
+    except IntegrityError:
+        # 既にルームにいるユーザーが入場しようとして PRIMARY KEY が重複した。
+        # with を抜けるときにロールバックされ、増やした人数も元に戻る。
+        return JoinRoomResult.OtherError
+    _clear_room_list_cache()
+    return JoinRoomResult.Ok
+
+
+_SQL_WAIT_ROOM = text(
+    "SELECT `room`.`status`, `room_member`.`user_id`, `user`.`name`,"
+    " `user`.`leader_card_id`, `room_member`.`select_difficulty`,"
+    " `room_member`.`is_host`"
+    " FROM `room`"
+    " LEFT JOIN `room_member` ON `room_member`.`room_id`=`room`.`room_id`"
+    " LEFT JOIN `user` ON `user`.`id`=`room_member`.`user_id`"
+    " WHERE `room`.`room_id`=:room_id"
+)
+
+
+def wait_room(token: str, room_id: int) -> tuple[WaitRoomStatus, list[RoomUser]]:
+    """ルームの状態と、ルームにいるプレイヤー一覧を返します"""
+    with autocommit_engine.connect() as conn:
+        user = _get_user_by_token_cached(conn, token)
+        if user is None:
+            raise InvalidToken
+        # ルームの状態とメンバー一覧を1回のクエリで取得する
+        result = conn.execute(_SQL_WAIT_ROOM, {"room_id": room_id})
+        status = WaitRoomStatus.Dissolution
+        room_users = []
+        # DB から取得した値なので validation を省略し、行を受け取りながら組み立てる
+        for row in result.mappings():
+            status = WaitRoomStatus(row["status"])
+            if row["user_id"] is None:
+                continue
+            room_users.append(
+                RoomUser.model_construct(
+                    user_id=row["user_id"],
+                    name=row["name"],
+                    leader_card_id=row["leader_card_id"],
+                    select_difficulty=LiveDifficulty(row["select_difficulty"]),
+                    is_me=row["user_id"] == user.id,
+                    is_host=bool(row["is_host"]),
+                )
+            )
+    return status, room_users
+
+
+# token からのユーザー検索、ホストかどうかの確認、ステータスの更新を1つの UPDATE で行う。
+# ホスト以外が呼んだときは JOIN する行がないので何も更新されない。
+_SQL_START_ROOM = text(
+    "UPDATE `room` JOIN `room_member`"
+    " ON `room_member`.`room_id`=`room`.`room_id` AND `room_member`.`is_host`"
+    " JOIN `user` ON `user`.`id`=`room_member`.`user_id`"
+    " SET `room`.`status`=:status"
+    " WHERE `room`.`room_id`=:room_id AND `room`.`status`=:waiting"
+    " AND `user`.`token`=UNHEX(:token)"
+).bindparams(
+    status=WaitRoomStatus.LiveStart.value, waiting=WaitRoomStatus.Waiting.value
+)
+
+
+def start_room(token: str, room_id: int) -> None:
+    """ライブを開始します。ホスト以外が呼んだときは何もしません"""
+    with engine.begin() as conn:
+        result = conn.execute(_SQL_START_ROOM, {"room_id": room_id, "token": token})
+        if result.rowcount == 0:
+            # 更新されなかったときだけ、 token が不正だったのかを調べる
+            if _get_user_by_token_cached(conn, token) is None:
+                raise InvalidToken
+            return
+    _clear_room_list_cache()
+
+
+_SQL_END_ROOM = text(
+    "UPDATE `room_member` JOIN `user` ON `user`.`id`=`room_member`.`user_id`"
+    " SET `room_member`.`score`=:score,"
+    " `room_member`.`judge_count_list`=:judge_count_list"
+    " WHERE `room_member`.`room_id`=:room_id AND `user`.`token`=UNHEX(:token)"
+).bindparams(bindparam("judge_count_list", type_=JSON))
+
+
+def end_room(token: str, room_id: int, judge_count_list: list[int], score: int) -> None:
+    """ライブの結果を記録します"""
+    with engine.begin() as conn:
+        result = conn.execute(
+            _SQL_END_ROOM,
+            {
+                "score": score,
+                "judge_count_list": judge_count_list,
+                "room_id": room_id,
+                "token": token,
+            },
+        )
+        if result.rowcount == 0 and _get_user_by_token_cached(conn, token) is None:
+            raise InvalidToken
+
+
+_SQL_RESULT_ROOM = text(
+    "SELECT `user_id`, `score`, `judge_count_list` FROM `room_member`"
+    " WHERE `room_id`=:room_id"
+).columns(judge_count_list=JSON)
+
+
+def result_room(room_id: int) -> list[ResultUser]:
+    """全員のライブ結果を返します。全員揃っていないときは空のリストを返します"""
+    with autocommit_engine.connect() as conn:
+        result = conn.execute(_SQL_RESULT_ROOM, {"room_id": room_id})
+        result_users = []
+        for row in result.mappings():
+            if row["score"] is None:
+                return []
+            result_users.append(
+                ResultUser.model_construct(
+                    user_id=row["user_id"],
+                    judge_count_list=row["judge_count_list"],
+                    score=row["score"],
+                )
+            )
+    return result_users
+
+
+_SQL_LEAVE_ROOM = text(
+    "UPDATE `room` JOIN `room_member`"
+    " ON `room_member`.`room_id`=`room`.`room_id`"
+    " AND `room_member`.`user_id`=:user_id"
+    " SET `room`.`joined_user_count`=`room`.`joined_user_count` - 1,"
+    " `room`.`status`=IF(`room_member`.`is_host`, :dissolution, `room`.`status`)"
+    " WHERE `room`.`room_id`=:room_id"
+).bindparams(dissolution=WaitRoomStatus.Dissolution.value)
+_SQL_DELETE_MEMBER = text(
+    "DELETE FROM `room_member` WHERE `room_id`=:room_id AND `user_id`=:user_id"
+)
+
+
+def leave_room(token: str, room_id: int) -> None:
+    """ルームから退出します。ホストが退出したときはルームを解散します"""
+    with engine.begin() as conn:
+        user = _get_user_by_token_cached(conn, token)
         if user is None:
             raise InvalidToken
-        # TODO: 実装
+        # 退出するユーザーがホストかどうかを別に SELECT せず、
+        # 人数の更新と解散を1つの UPDATE で済ませる
+        conn.execute(_SQL_LEAVE_ROOM, {"user_id": user.id, "room_id": room_id})
+        conn.execute(_SQL_DELETE_MEMBER, {"room_id": room_id, "user_id": user.id})
+    _clear_room_list_cache()
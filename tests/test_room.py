@@ -68,3 +68,125 @@ def test_room_1():
     )
     assert response.status_code == 200
     print("room/result response:", response.json())
+
+
+def test_room_leave():
+    response = client.post(
+        "/room/create",
+        headers=_auth_header(1),
+        json={"live_id": 1002, "select_difficulty": 1},
+    )
+    assert response.status_code == 200
+    room_id = response.json()["room_id"]
+
+    response = client.post(
+        "/room/join",
+        headers=_auth_header(2),
+        json={"room_id": room_id, "select_difficulty": 2},
+    )
+    assert response.status_code == 200
+    assert response.json()["join_room_result"] == 1
+
+    response = client.post(
+        "/room/leave", headers=_auth_header(2), json={"room_id": room_id}
+    )
+    assert response.status_code == 200
+
+    response = client.post(
+        "/room/wait", headers=_auth_header(1), json={"room_id": room_id}
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == 1
+    assert len(response.json()["room_user_list"]) == 1
+
+    # ホストが退出すると解散される
+    response = client.post(
+        "/room/leave", headers=_auth_header(1), json={"room_id": room_id}
+    )
+    assert response.status_code == 200
+
+    response = client.post(
+        "/room/wait", headers=_auth_header(1), json={"room_id": room_id}
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == 3
+
+
+def test_room_join_twice():
+    response = client.post(
+        "/room/create",
+        headers=_auth_header(3),
+        json={"live_id": 1003, "select_difficulty": 1},
+    )
+    assert response.status_code == 200
+    room_id = response.json()["room_id"]
+
+    response = client.post(
+        "/room/join",
+        headers=_auth_header(4),
+        json={"room_id": room_id, "select_difficulty": 1},
+    )
+    assert response.status_code == 200
+    assert response.json()["join_room_result"] == 1
+
+    # 既に入場しているユーザー (ホストを含む) がもう一度入場すると OtherError
+    for i in (4, 3):
+        response = client.post(
+            "/room/join",
+            headers=_auth_header(i),
+            json={"room_id": room_id, "select_difficulty": 2},
+        )
+        assert response.status_code == 200
+        assert response.json()["join_room_result"] == 4
+
+    response = client.post(
+        "/room/wait", headers=_auth_header(3), json={"room_id": room_id}
+    )
+    assert response.status_code == 200
+    assert len(response.json()["room_user_list"]) == 2
+
+    # 失敗した入場で人数が増えていないので、残り2人は入場できる
+    for i in (5, 6):
+        response = client.post(
+            "/room/join",
+            headers=_auth_header(i),
+            json={"room_id": room_id, "select_difficulty": 1},
+        )
+        assert response.status_code == 200
+        assert response.json()["join_room_result"] == 1
+
+    response = client.post(
+        "/room/join",
+        headers=_auth_header(7),
+        json={"room_id": room_id, "select_difficulty": 1},
+    )
+    assert response.status_code == 200
+    assert response.json()["join_room_result"] == 2
+
+
+def test_room_list_after_room_id():
+    room_ids = []
+    for i in (8, 9):
+        response = client.post(
+            "/room/create",
+            headers=_auth_header(i),
+            json={"live_id": 1004, "select_difficulty": 1},
+        )
+        assert response.status_code == 200
+        room_ids.append(response.json()["room_id"])
+
+    # after_room_id より後のルームだけを返す
+    response = client.post(
+        "/room/list", json={"live_id": 1004, "after_room_id": room_ids[0]}
+    )
+    assert response.status_code == 200
+    room_info_list = response.json()["room_info_list"]
+    assert [room["room_id"] for room in room_info_list] == room_ids[1:]
+
+    # キャッシュしない続きのページも room_id 順に返す
+    response = client.post(
+        "/room/list", json={"live_id": 1004, "after_room_id": room_ids[0] - 1}
+    )
+    assert response.status_code == 200
+    room_info_list = response.json()["room_info_list"]
+    assert [room["room_id"] for room in room_info_list] == room_ids
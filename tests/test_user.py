@@ -23,3 +23,28 @@ def test_create_user():
     assert response_data.keys() == {"id", "name", "leader_card_id"}
     assert response_data["name"] == "test1"
     assert response_data["leader_card_id"] == 1000
+
+
+def test_update_user():
+    response = client.post(
+        "/user/create", json={"user_name": "test2", "leader_card_id": 1000}
+    )
+    assert response.status_code == 200
+    headers = {"Authorization": f"bearer {response.json()['user_token']}"}
+
+    # キャッシュに載せてから更新する
+    response = client.get("/user/me", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "test2"
+
+    response = client.post(
+        "/user/update",
+        headers=headers,
+        json={"user_name": "test2-updated", "leader_card_id": 2000},
+    )
+    assert response.status_code == 200
+
+    response = client.get("/user/me", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "test2-updated"
+    assert response.json()["leader_card_id"] == 2000